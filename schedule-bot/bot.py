@@ -1,9 +1,13 @@
 # Основной файл Telegram бота расписания
 
+import asyncio
 import logging
+from functools import lru_cache
 from datetime import datetime, timedelta
+from typing import Optional
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     MessageHandler,
@@ -11,13 +15,16 @@ from telegram.ext import (
     ContextTypes,
     ConversationHandler,
     CallbackQueryHandler,
-    CallbackContext
+    CallbackContext,
+    PicklePersistence,
+    PersistenceInput
 )
 
 from config import (
-    TELEGRAM_BOT_TOKEN, DAYS_RU, DAYS_SHORT, SCHEDULE_FILE,
+    TELEGRAM_BOT_TOKEN, DAYS_RU, DAYS_SHORT, SCHEDULE_FILE, LEGACY_USERS_JSON,
     WELCOME_MESSAGE, HELP_MESSAGE, ERROR_NO_SCHEDULE, ERROR_GROUP_NOT_FOUND,
-    AVAILABLE_TIMES
+    AVAILABLE_TIMES, NOTIFICATION_CONCURRENCY, NOTIFICATION_MAX_RETRIES,
+    WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET, PERSISTENCE_FILE
 )
 from schedule_parser import ScheduleParser
 from user_database import UserDatabase
@@ -30,9 +37,12 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Инициализация
-db = UserDatabase()
+db = UserDatabase(legacy_json_path=LEGACY_USERS_JSON)
 parser = ScheduleParser(SCHEDULE_FILE)
 
+# Сокращение дня → полное название ('пн' → 'понедельник')
+DAY_SHORT_TO_FULL = dict(zip(DAYS_SHORT, DAYS_RU))
+
 # Состояния для ConversationHandler
 CHOOSING_GROUP = 1
 CHOOSING_ACTION = 2
@@ -41,7 +51,7 @@ CHOOSING_DAY = 4
 
 
 
-def get_groups_keyboard():
+def build_groups_keyboard():
     """Создает клавиатуру со всеми группами"""
     groups = parser.get_groups()
     if not groups:
@@ -58,7 +68,7 @@ def get_groups_keyboard():
     return ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
 
 
-def get_time_keyboard():
+def build_time_keyboard():
     """Создает клавиатуру с временем"""
     keyboard = []
     for i in range(0, len(AVAILABLE_TIMES), 3):
@@ -68,7 +78,7 @@ def get_time_keyboard():
     return ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
 
 
-def get_days_keyboard():
+def build_days_keyboard():
     """Создает клавиатуру со всеми днями недели"""
     keyboard = [
         ['пн', 'вт', 'ср'],
@@ -78,7 +88,7 @@ def get_days_keyboard():
     return ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True)
 
 
-def get_action_keyboard():
+def build_action_keyboard():
     """Создает клавиатуру с основными действиями"""
     keyboard = [
         ['📅 Сегодня', '📅 Завтра'],
@@ -89,6 +99,46 @@ def get_action_keyboard():
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
 
+# Клавиатуры не меняются во время работы, создаём их один раз.
+# Клавиатура групп собирается в post_init, после загрузки расписания.
+TIME_KEYBOARD = build_time_keyboard()
+DAYS_KEYBOARD = build_days_keyboard()
+ACTION_KEYBOARD = build_action_keyboard()
+GROUPS_KEYBOARD = None
+
+
+def split_message(text: str, limit: int = 3000):
+    """Нарезает текст на сообщения короче limit, разрезая по пустым строкам"""
+    # Telegram ограничивает длину сообщения до 4096 символов
+    parts = []
+    size = 0
+    for block in text.split('\n\n'):
+        if size + len(block) >= limit and parts:
+            yield "".join(parts)
+            parts, size = [], 0
+        parts.append(block + "\n\n")
+        size += len(block) + 2
+
+    if parts:
+        yield "".join(parts)
+
+
+@lru_cache(maxsize=None)
+def get_week_messages(group: str) -> tuple:
+    """Расписание на неделю, уже нарезанное на сообщения (сбрасывается при парсинге)"""
+    return tuple(split_message(parser.get_schedule_for_week(group)))
+
+
+def get_user_group(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[str]:
+    """Группа пользователя: сначала из context.user_data, затем из БД"""
+    group = context.user_data.get('group')
+    if group is None:
+        group = db.get_user_group(update.effective_user.id)
+        if group is not None:
+            context.user_data['group'] = group
+    return group
+
+
 # ОБРАБОТЧИКИ КОМАНД
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -98,18 +148,19 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Проверяем, зарегистрирован ли пользователь
     if db.user_exists(user_id):
         current_group = db.get_user_group(user_id)
+        context.user_data['group'] = current_group
         await update.message.reply_text(
             f"👋 Добро пожаловать назад!\n\n"
             f"Ваша группа: {current_group}\n\n"
             f"Выберите действие:",
-            reply_markup=get_action_keyboard()
+            reply_markup=ACTION_KEYBOARD
         )
         return CHOOSING_ACTION
 
     # Новый пользователь
     await update.message.reply_text(
         WELCOME_MESSAGE,
-        reply_markup=get_groups_keyboard()
+        reply_markup=GROUPS_KEYBOARD
     )
     return CHOOSING_GROUP
 
@@ -117,17 +168,17 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def set_notification_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Позволяет установить время отправки расписания"""
     user_id = update.effective_user.id
-    group = db.get_user_group(user_id)
+    group = get_user_group(update, context)
 
     if not group:
         await update.message.reply_text("❌ Сначала выберите группу: /start")
         return CHOOSING_ACTION
 
-    current_time = db.get_notification_time(user_id)
+    current_time = await asyncio.to_thread(db.get_notification_time, user_id)
     await update.message.reply_text(
         f"⏰ Текущее время отправки: {current_time}\n\n"
         f"Выберите новое время:",
-        reply_markup=get_time_keyboard()
+        reply_markup=TIME_KEYBOARD
     )
     return CHOOSING_NOTIFICATION_TIME
 
@@ -140,7 +191,7 @@ async def handle_time_selection(update: Update, context: ContextTypes.DEFAULT_TY
     if time_str == 'Отмена':
         await update.message.reply_text(
             "Выберите действие:",
-            reply_markup=get_action_keyboard()
+            reply_markup=ACTION_KEYBOARD
         )
         return CHOOSING_ACTION
 
@@ -148,21 +199,21 @@ async def handle_time_selection(update: Update, context: ContextTypes.DEFAULT_TY
     if time_str not in AVAILABLE_TIMES:
         await update.message.reply_text(
             f"❌ Неверный формат времени. Выберите из предложенных:",
-            reply_markup=get_time_keyboard()
+            reply_markup=TIME_KEYBOARD
         )
         return CHOOSING_NOTIFICATION_TIME
 
     # Сохраняем время
-    if db.set_notification_time(user_id, time_str):
+    if await asyncio.to_thread(db.set_notification_time, user_id, time_str):
         await update.message.reply_text(
             f"✅ Расписание будет отправляться в {time_str}\n\n"
             f"Выберите действие:",
-            reply_markup=get_action_keyboard()
+            reply_markup=ACTION_KEYBOARD
         )
     else:
         await update.message.reply_text(
             f"❌ Ошибка при сохранении времени. Попытайтесь еще раз:",
-            reply_markup=get_time_keyboard()
+            reply_markup=TIME_KEYBOARD
         )
         return CHOOSING_NOTIFICATION_TIME
 
@@ -175,20 +226,27 @@ async def choose_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
     group = update.message.text.strip()
 
     # Проверяем, существует ли такая группа
-    if group not in parser.get_groups():
+    if not parser.has_group(group):
         await update.message.reply_text(
             f"{ERROR_GROUP_NOT_FOUND}\n\nПопытайтесь еще раз:",
-            reply_markup=get_groups_keyboard()
+            reply_markup=GROUPS_KEYBOARD
         )
         return CHOOSING_GROUP
 
-    # Сохраняем группу пользователя
-    db.add_user(user_id, group)
+    # Сохраняем группу пользователя (запись в БД выполняем вне event loop)
+    if not await asyncio.to_thread(db.add_user, user_id, group):
+        # В user_data группу не кладём: без строки в БД не будет уведомлений
+        await update.message.reply_text(
+            f"❌ Ошибка при сохранении группы. Попытайтесь еще раз:",
+            reply_markup=GROUPS_KEYBOARD
+        )
+        return CHOOSING_GROUP
+    context.user_data['group'] = group
 
     await update.message.reply_text(
         f"✅ Спасибо! Вы выбрали группу: {group}\n\n"
         f"Теперь выберите действие:",
-        reply_markup=get_action_keyboard()
+        reply_markup=ACTION_KEYBOARD
     )
 
     return CHOOSING_ACTION
@@ -196,8 +254,7 @@ async def choose_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def show_today_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает расписание на сегодня"""
-    user_id = update.effective_user.id
-    group = db.get_user_group(user_id)
+    group = get_user_group(update, context)
 
     if not group:
         await update.message.reply_text("❌ Сначала выберите группу: /start")
@@ -213,14 +270,13 @@ async def show_today_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE
 
     await update.message.reply_text(
         schedule_text,
-        reply_markup=get_action_keyboard()
+        reply_markup=ACTION_KEYBOARD
     )
 
 
 async def show_tomorrow_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает расписание на завтра"""
-    user_id = update.effective_user.id
-    group = db.get_user_group(user_id)
+    group = get_user_group(update, context)
 
     if not group:
         await update.message.reply_text("❌ Сначала выберите группу: /start")
@@ -236,44 +292,24 @@ async def show_tomorrow_schedule(update: Update, context: ContextTypes.DEFAULT_T
 
     await update.message.reply_text(
         schedule_text,
-        reply_markup=get_action_keyboard()
+        reply_markup=ACTION_KEYBOARD
     )
 
 
 async def show_week_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает расписание на неделю"""
-    user_id = update.effective_user.id
-    group = db.get_user_group(user_id)
+    group = get_user_group(update, context)
 
     if not group:
         await update.message.reply_text("❌ Сначала выберите группу: /start")
         return
 
-    schedule_text = parser.get_schedule_for_week(group)
-
-    # Telegram ограничивает длину сообщения до 4096 символов
-    # Разбиваем расписание по дням
-    messages = schedule_text.split('\n\n')
-    full_messages = []
-    current_msg = ""
-
-    for msg in messages:
-        if len(current_msg) + len(msg) < 3000:
-            current_msg += msg + "\n\n"
-        else:
-            if current_msg:
-                full_messages.append(current_msg)
-            current_msg = msg + "\n\n"
-
-    if current_msg:
-        full_messages.append(current_msg)
-
-    for msg in full_messages:
+    for msg in get_week_messages(group):
         await update.message.reply_text(msg)
 
     await update.message.reply_text(
         "Выберите действие:",
-        reply_markup=get_action_keyboard()
+        reply_markup=ACTION_KEYBOARD
     )
 
 
@@ -281,15 +317,14 @@ async def choose_day(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Запрашивает выбор дня недели"""
     await update.message.reply_text(
         "📅 Выберите день недели:",
-        reply_markup=get_days_keyboard()
+        reply_markup=DAYS_KEYBOARD
     )
     return CHOOSING_DAY
 
 
 async def show_day_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает расписание для выбранного дня"""
-    user_id = update.effective_user.id
-    group = db.get_user_group(user_id)
+    group = get_user_group(update, context)
 
     if not group:
         await update.message.reply_text("❌ Сначала выберите группу: /start")
@@ -300,21 +335,17 @@ async def show_day_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if day_input == "отмена":
         await update.message.reply_text(
             "Выберите действие:",
-            reply_markup=get_action_keyboard()
+            reply_markup=ACTION_KEYBOARD
         )
         return CHOOSING_ACTION
 
     # Преобразуем сокращение дня в полное название
-    day_name = None
-    for i, short in enumerate(DAYS_SHORT):
-        if day_input == short:
-            day_name = DAYS_RU[i]
-            break
+    day_name = DAY_SHORT_TO_FULL.get(day_input)
 
     if not day_name:
         await update.message.reply_text(
             "❌ Неизвестный день. Выберите из предложенных:",
-            reply_markup=get_days_keyboard()
+            reply_markup=DAYS_KEYBOARD
         )
         return CHOOSING_DAY
 
@@ -322,7 +353,7 @@ async def show_day_schedule(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text(
         schedule_text,
-        reply_markup=get_action_keyboard()
+        reply_markup=ACTION_KEYBOARD
     )
     return CHOOSING_ACTION
 
@@ -331,7 +362,7 @@ async def change_group(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Позволяет изменить группу"""
     await update.message.reply_text(
         "Выберите новую группу:",
-        reply_markup=get_groups_keyboard()
+        reply_markup=GROUPS_KEYBOARD
     )
     return CHOOSING_GROUP
 
@@ -350,35 +381,37 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 
+async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Ответ на неизвестный текст в главном меню"""
+    await update.message.reply_text(
+        "❌ Неизвестная команда. Используйте /help для справки.",
+        reply_markup=ACTION_KEYBOARD
+    )
+
+
+# Кнопки главного меню → обработчики
+TEXT_HANDLERS = {
+    "📅 Сегодня": show_today_schedule,
+    "📅 Завтра": show_tomorrow_schedule,
+    "📅 Неделя": show_week_schedule,
+    "🔍 День": choose_day,
+    "⏰ Время уведомлений": set_notification_time,
+    "✏️ Изменить группу": change_group,
+    "❌ Выход": cancel,
+}
+
+
 async def handle_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик текстовых сообщений"""
-    text = update.message.text.strip()
-
-    if text == "📅 Сегодня":
-        await show_today_schedule(update, context)
-    elif text == "📅 Завтра":
-        await show_tomorrow_schedule(update, context)
-    elif text == "📅 Неделя":
-        await show_week_schedule(update, context)
-    elif text == "🔍 День":
-        return await choose_day(update, context)
-    elif text == "⏰ Время уведомлений":
-        return await set_notification_time(update, context)
-    elif text == "✏️ Изменить группу":
-        return await change_group(update, context)
-    elif text == "❌ Выход":
-        return await cancel(update, context)
-    else:
-        await update.message.reply_text(
-            "❌ Неизвестная команда. Используйте /help для справки.",
-            reply_markup=get_action_keyboard()
-        )
+    handler = TEXT_HANDLERS.get(update.message.text.strip(), unknown_command)
+    return await handler(update, context)
 
 
 # ИНИЦИАЛИЗАЦИЯ БОТА
 
 async def post_init(app: Application):
     """Инициализация после запуска"""
+    global GROUPS_KEYBOARD
     logger.info("🤖 Бот запущен!")
 
     # Парсим расписание при запуске
@@ -387,6 +420,9 @@ async def post_init(app: Application):
     else:
         logger.error("❌ Не удалось загрузить расписание!")
 
+    get_week_messages.cache_clear()
+    GROUPS_KEYBOARD = build_groups_keyboard()
+
     # Добавляем планировщик уведомлений
     app.job_queue.run_repeating(
         send_scheduled_notifications,
@@ -397,17 +433,24 @@ async def post_init(app: Application):
     logger.info("✅ Планировщик уведомлений запущен")
 
 
+async def post_shutdown(app: Application):
+    """Освобождение ресурсов при остановке"""
+    db.close()
+    logger.info("👋 Соединение с БД закрыто")
+
+
 async def send_scheduled_notifications(context: ContextTypes.DEFAULT_TYPE):
     """Отправляет расписание на день всем пользователям в нужное время"""
-    current_time = datetime.now().strftime('%H:%M')
+    now = datetime.now()
+    current_time = now.strftime('%H:%M')
 
     # Получаем пользователей, у которых сейчас время уведомлений
-    users = db.get_users_by_notification_time(current_time)
+    users = await asyncio.to_thread(db.get_users_by_notification_time, current_time)
 
     if not users:
         return
 
-    today = datetime.now().weekday()
+    today = now.weekday()
 
     # Не отправляем в выходные (сб=5, вс=6)
     if today > 4:
@@ -415,26 +458,51 @@ async def send_scheduled_notifications(context: ContextTypes.DEFAULT_TYPE):
         return
 
     day_name = DAYS_RU[today]
+    semaphore = asyncio.Semaphore(NOTIFICATION_CONCURRENCY)
+
+    # Текст одинаковый для всей группы - форматируем его один раз
+    texts = {
+        group: f"📅 Расписание на {day_name}:\n\n{parser.format_day_schedule(group, day_name)}"
+        for group in set(users.values())
+    }
+
+    async def send_one(user_id: int, text: str):
+        async with semaphore:
+            await context.bot.send_message(chat_id=user_id, text=text)
+
+    # Отправляем параллельно, ошибки собираем и логируем в конце
+    results = await asyncio.gather(
+        *(send_one(user_id, texts[group]) for user_id, group in users.items()),
+        return_exceptions=True
+    )
 
-    for user_id, group in users.items():
-        try:
-            schedule_text = parser.format_day_schedule(group, day_name)
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"📅 Расписание на {day_name}:\n\n{schedule_text}"
-            )
+    for user_id, result in zip(users, results):
+        if isinstance(result, Exception):
+            logger.error(f"❌ Ошибка при отправке {user_id}: {str(result)}")
+        else:
             logger.info(f"✅ Расписание отправлено {user_id}")
-        except Exception as e:
-            logger.error(f"❌ Ошибка при отправке {user_id}: {str(e)}")
 
 
 def main():
     """Главная функция запуска бота"""
-    # Создаем приложение
-    app = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    # Создаем приложение (user_data с группой переживает перезапуск)
+    persistence = PicklePersistence(
+        filepath=PERSISTENCE_FILE,
+        store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False)
+    )
+    # AIORateLimiter держит отправку в лимитах Telegram (~30 сообщений в секунду)
+    # и повторяет запрос после RetryAfter (429), чтобы расписание не терялось
+    app = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .persistence(persistence)
+        .rate_limiter(AIORateLimiter(max_retries=NOTIFICATION_MAX_RETRIES))
+        .build()
+    )
 
     # Добавляем обработчик инициализации
     app.post_init = post_init
+    app.post_shutdown = post_shutdown
 
     # ConversationHandler для основного потока
     conv_handler = ConversationHandler(
@@ -442,9 +510,6 @@ def main():
         states={
             CHOOSING_GROUP: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_group)],
             CHOOSING_ACTION: [
-                MessageHandler(filters.Regex(
-                    r'^(📅 Сегодня|📅 Завтра|📅 Неделя|🔍 День|⏰ Время уведомлений|✏️ Изменить группу|❌ Выход)$'),
-                    handle_text),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text)
             ],
             CHOOSING_DAY: [
@@ -464,9 +529,21 @@ def main():
     app.add_handler(CommandHandler("tomorrow", show_tomorrow_schedule))
     app.add_handler(CommandHandler("week", show_week_schedule))
 
-    # Запускаем бота
-    logger.info("🚀 Запуск бота...")
-    app.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Запускаем бота: в продакшене Telegram сам присылает апдейты на webhook,
+    # локально используем long polling
+    if WEBHOOK_URL:
+        logger.info(f"🚀 Запуск бота (webhook, порт {WEBHOOK_PORT})...")
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=TELEGRAM_BOT_TOKEN,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{TELEGRAM_BOT_TOKEN}",
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        logger.info("🚀 Запуск бота...")
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
 
 
 if __name__ == "__main__":
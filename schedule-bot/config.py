@@ -10,6 +10,12 @@ load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', 'YOUR_TOKEN_HERE')
 ADMIN_ID = int(os.getenv('ADMIN_ID', '0'))
 
+# Webhook для продакшена. Если WEBHOOK_URL не задан - бот работает через long polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # например, https://bot.example.com
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+
 
 DAYS_RU = ['понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота', 'воскресенье']
 DAYS_SHORT = ['пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс']
@@ -17,7 +23,9 @@ DAYS_SHORT = ['пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс']
 
 SCHEDULE_FILE = 'schedules/schedule.xlsx'
 USERS_DB = 'data/users.db'  # ✅ НОВОЕ
+LEGACY_USERS_JSON = 'data/users.json'  # Старая JSON-база, импортируется в SQLite один раз (отметка в PRAGMA user_version)
 LOG_FILE = 'logs/bot.log'
+PERSISTENCE_FILE = 'data/bot_persistence.pickle'  # context.user_data между перезапусками
 
 
 GROUPS_ROW = 17  # Строка где находятся номера групп
@@ -33,6 +41,12 @@ EVENING_NOTIFICATION_MINUTE = 0
 
 DEFAULT_NOTIFICATION_TIME = '08:00'
 
+# Сколько запросов на отправку уведомлений держим в полёте одновременно.
+# Это не лимит в секунду: скорость ограничивает AIORateLimiter в bot.py
+NOTIFICATION_CONCURRENCY = 25
+# Сколько раз повторять отправку после RetryAfter (HTTP 429) от Telegram
+NOTIFICATION_MAX_RETRIES = 3
+
 
 AVAILABLE_TIMES = [
     '07:00', '08:00', '09:00', '10:00', '11:00',
@@ -22,12 +22,9 @@ class ExcelMerger:
             new_wb = openpyxl.Workbook()
             new_ws = new_wb.active
 
-            # Копируем всё содержимое как есть сначала
-            max_row = ws.max_row
-            max_col = ws.max_column
-            for r in range(1, max_row + 1):
-                for c in range(1, max_col + 1):
-                    new_ws.cell(row=r, column=c).value = ws.cell(row=r, column=c).value
+            # Копируем всё содержимое как есть сначала (построчно, только значения)
+            for row in ws.iter_rows(values_only=True):
+                new_ws.append(row)
 
             logger.info("🔍 Ищем объединённые диапазоны...")
             merged_ranges = list(ws.merged_cells.ranges)
@@ -51,34 +48,18 @@ class ExcelMerger:
         src_ws — исходный лист с настоящими merged-ячейками
         dst_ws — новый лист, где мы просто дублируем значения
         """
-        range_str = str(merged_range)
-        start_cell, end_cell = range_str.split(':')
-
-        start_col, start_row = self._parse_cell(start_cell)
-        end_col, end_row = self._parse_cell(end_cell)
+        start_row, start_col = merged_range.min_row, merged_range.min_col
+        end_row, end_col = merged_range.max_row, merged_range.max_col
 
         # значение из верхней левой ячейки ИСТОЧНИКА
         top_left_val = src_ws.cell(row=start_row, column=start_col).value
-        logger.info(f"  Диапазон {range_str}: значение '{top_left_val}'")
+        logger.info(f"  Диапазон {merged_range.coord}: значение '{top_left_val}'")
 
         # Во ВСЕ ячейки диапазона НОВОГО листа записываем это значение
         for r in range(start_row, end_row + 1):
             for c in range(start_col, end_col + 1):
                 dst_ws.cell(row=r, column=c).value = top_left_val
 
-    @staticmethod
-    def _parse_cell(cell_str: str) -> tuple:
-        col_str = ""
-        row_str = ""
-        for ch in cell_str:
-            if ch.isalpha():
-                col_str += ch
-            else:
-                row_str += ch
-        col = openpyxl.utils.column_index_from_string(col_str)
-        row = int(row_str)
-        return col, row
-
 
 if __name__ == "__main__":
     merger = ExcelMerger(
@@ -1,5 +1,43 @@
-import pandas as pd
-from typing import Dict, List
+import re
+from functools import lru_cache
+
+import openpyxl
+from typing import Any, Dict, FrozenSet, List, Tuple
+
+
+DAY_DISPLAY = {
+    'понедельник': '📍 ПОНЕДЕЛЬНИК',
+    'вторник': '📍 ВТОРНИК',
+    'среда': '📍 СРЕДА',
+    'четверг': '📍 ЧЕТВЕРГ',
+    'пятница': '📍 ПЯТНИЦА',
+    'суббота': '📍 СУББОТА',
+    'воскресенье': '📍 ВОСКРЕСЕНЬЕ'
+}
+
+WEEK_DAYS = ['понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота']
+
+# Номер группы: начинается с цифры, содержит '-', '(' и ')' (например, '09-512 (1)')
+_GROUP_NAME_RE = re.compile(r'\d(?=.*-)(?=.*\()(?=.*\))', re.DOTALL)
+# Время пары: от 8 символов, содержит '-' и '.' или ':' (например, '8.30-10.00')
+_TIME_RE = re.compile(r'(?=.*-)(?=.*[.:]).{8}', re.DOTALL)
+
+
+# Одни и те же строки времени повторяются во всех днях и группах
+@lru_cache(maxsize=64)
+def _time_to_minutes(time_str: str) -> int:
+    """Преобразует '8.30-10.00' в минуты для сортировки"""
+    try:
+        start_time = time_str.split('-')[0].strip()
+        hours, minutes = start_time.split('.')
+        return int(hours) * 60 + int(minutes)
+    except:
+        return 0
+
+
+@lru_cache(maxsize=64)
+def _is_time(value: str) -> bool:
+    return _TIME_RE.match(value) is not None
 
 
 class ScheduleParser:
@@ -7,11 +45,16 @@ class ScheduleParser:
         self.file_path = file_path
         self.groups = []
         self.schedule = {}
-        self.df = None
+        self.rows: List[tuple] = []
+        # Готовые ответы: расписание после parse() не меняется
+        self._groups_list: Tuple[str, ...] = ()
+        self._day_formatted: Dict[Tuple[str, str], str] = {}
+        self._week_formatted: Dict[str, str] = {}
+        self._group_names_set: FrozenSet[str] = frozenset()
 
     def parse(self) -> bool:
         try:
-            self.df = pd.read_excel('schedules/schedule_merged.xlsx', sheet_name=0, header=None)
+            self.rows = self._read_rows('schedules/schedule_merged.xlsx')
 
             self._find_and_extract_groups()
 
@@ -24,20 +67,42 @@ class ScheduleParser:
                 print(f"  {g['name']} → колонка {g['column']}")
 
             self._parse_schedule()
+            self._build_formatted_cache()
             return True
 
         except Exception as e:
             print(f"❌ Ошибка: {e}")
             return False
 
+    @staticmethod
+    def _read_rows(path: str) -> List[tuple]:
+        """Читает значения первого листа построчно (read-only, без форматирования)"""
+        wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            ws = wb.worksheets[0]
+            # Размеры в файле бывают неверными, читаем лист с A1 до конца
+            ws.reset_dimensions()
+            return list(ws.iter_rows(values_only=True))
+        finally:
+            wb.close()
+
+    def _cell(self, row_idx: int, col_idx: int) -> Any:
+        """Значение ячейки (индексы с нуля) или None, если ячейка пустая"""
+        if row_idx >= len(self.rows):
+            return None
+        row = self.rows[row_idx]
+        if col_idx >= len(row) or row[col_idx] == '':
+            return None
+        return row[col_idx]
+
     def _find_and_extract_groups(self):
-        for row_idx in range(0, min(30, len(self.df))):
-            row = self.df.iloc[row_idx]
+        for row_idx in range(0, min(30, len(self.rows))):
+            row = self.rows[row_idx]
             groups_in_row = []
 
             for col_idx in range(2, len(row)):
-                value = row.iloc[col_idx]
-                if pd.notna(value):
+                value = row[col_idx]
+                if value is not None:
                     value_str = str(value).strip()
                     if self._is_group_name(value_str):
                         groups_in_row.append({'name': value_str, 'column': col_idx})
@@ -45,14 +110,13 @@ class ScheduleParser:
             if len(groups_in_row) >= 2:
                 self.groups = groups_in_row
                 self.groups_row = row_idx
+                self._group_names_set = frozenset(g['name'] for g in self.groups)
                 break
 
     def _is_group_name(self, value: str) -> bool:
-        if 'ИНФОРМАТИКА' in value.upper() or len(value) < 5:
+        if len(value) < 5 or 'ИНФОРМАТИКА' in value.upper():
             return False
-        if '-' in value and '(' in value and ')' in value and value[0].isdigit():
-            return True
-        return False
+        return _GROUP_NAME_RE.match(value) is not None
 
     def _parse_schedule(self):
         days_ranges = {
@@ -64,6 +128,23 @@ class ScheduleParser:
             'суббота': (94, 108),
         }
 
+        # Колонку времени читаем один раз на день: пустые ячейки
+        # (объединённые в исходнике) заполняем ближайшим корректным временем выше.
+        # Подписи вроде 'перерыв' остаются в своей строке, но не продлеваются вниз
+        time_columns = {}
+        for day_name, (start_row, end_row) in days_ranges.items():
+            last_time = None
+            times = []
+            for row_idx in range(start_row, end_row + 1):
+                time_value = self._cell(row_idx, 1)
+                if time_value is None:
+                    times.append(last_time)
+                    continue
+                if _is_time(str(time_value).strip()):
+                    last_time = time_value
+                times.append(time_value)
+            time_columns[day_name] = times
+
         for group_info in self.groups:
             group_name = group_info['name']
             col_idx = group_info['column']
@@ -80,67 +161,51 @@ class ScheduleParser:
 
             for day_name, (start_row, end_row) in days_ranges.items():
                 lessons_by_time = {}
-                last_time = None
-                last_lesson = None
-
-                for row_idx in range(start_row, end_row + 1):
-                    time_value = self.df.iloc[row_idx, 1]
-                    lesson_value = self.df.iloc[row_idx, col_idx]
-
-                    # Если в нашей колонке пусто
-                    if pd.isna(lesson_value):
-                        pass  # Оставляем lesson_value пустым
-
-                    # Если время пусто - используем последнее
-                    if pd.isna(time_value):
-                        time_value = last_time
+                lesson_col = [self._cell(row_idx, col_idx) for row_idx in range(start_row, end_row + 1)]
 
+                for time_value, lesson_value in zip(time_columns[day_name], lesson_col):
                     # Проверяем: есть ли и время и пара?
-                    if pd.notna(time_value) and pd.notna(lesson_value):
-                        time_str = str(time_value).strip()
-                        lesson_str = str(lesson_value).strip()
+                    if time_value is None or lesson_value is None:
+                        continue
 
-                        # Обновляем последнее время если это новое время
-                        if self._is_time(time_str):
-                            last_time = time_str
-                            last_lesson = None
+                    time_str = str(time_value).strip()
+                    lesson_str = str(lesson_value).strip()
 
-                        # Добавляем пару ТОЛЬКО если это не дубликат последней
-                        if (self._is_time(time_str) and
-                                lesson_str and
-                                lesson_str != 'nan' and
-                                len(lesson_str) > 2 and
-                                lesson_str != last_lesson):
+                    if (_is_time(time_str) and
+                            lesson_str and
+                            lesson_str != 'nan' and
+                            len(lesson_str) > 2):
 
-                            if time_str not in lessons_by_time:
-                                lessons_by_time[time_str] = set()
+                        if time_str not in lessons_by_time:
+                            lessons_by_time[time_str] = []
 
-                            lessons_by_time[time_str].add(lesson_str)
-                            last_lesson = lesson_str
+                        lessons_by_time[time_str].append(lesson_str)
 
                 # 🔑 Сортируем по времени
-                sorted_times = sorted(lessons_by_time.keys(), key=lambda t: self._time_to_minutes(t))
+                sorted_times = sorted(lessons_by_time.keys(), key=_time_to_minutes)
 
                 for time_str in sorted_times:
-                    formatted = f"⏰ {time_str}"
-                    for lesson in sorted(lessons_by_time[time_str]):
-                        formatted += f"\n📚 {lesson}"
-                    self.schedule[group_name][day_name].append(formatted)
-
-    def _time_to_minutes(self, time_str: str) -> int:
-        """Преобразует '8.30-10.00' в минуты для сортировки"""
-        try:
-            start_time = time_str.split('-')[0].strip()
-            hours, minutes = start_time.split('.')
-            return int(hours) * 60 + int(minutes)
-        except:
-            return 0
+                    parts = [f"⏰ {time_str}"]
+                    # Убираем повторы, сохраняя порядок из таблицы
+                    for lesson in dict.fromkeys(lessons_by_time[time_str]):
+                        parts.append(f"📚 {lesson}")
+                    self.schedule[group_name][day_name].append("\n".join(parts))
+
+    def _build_formatted_cache(self):
+        """Форматирует расписание всех групп один раз после парсинга"""
+        self._groups_list = tuple(g['name'] for g in self.groups)
+        self._day_formatted = {
+            (group, day): self._format_day(group, day)
+            for group in self._groups_list
+            for day in DAY_DISPLAY
+        }
+        self._week_formatted = {group: self._format_week(group) for group in self._groups_list}
 
-    def _is_time(self, value: str) -> bool:
-        return '-' in value and len(value) >= 8 and ('.' in value or ':' in value)
+    def get_groups(self) -> Tuple[str, ...]:
+        return self._groups_list
 
-    def get_groups(self) -> List[str]:
-        return [g['name'] for g in self.groups]
+    def has_group(self, name: str) -> bool:
+        return name in self._group_names_set
 
     def get_schedule_for_group(self, group: str) -> Dict:
         return self.schedule.get(group, {})
@@ -150,32 +215,35 @@ class ScheduleParser:
 
     def format_day_schedule(self, group: str, day: str) -> str:
         day_lower = day.lower()
-        day_display = {
-            'понедельник': '📍 ПОНЕДЕЛЬНИК',
-            'вторник': '📍 ВТОРНИК',
-            'среда': '📍 СРЕДА',
-            'четверг': '📍 ЧЕТВЕРГ',
-            'пятница': '📍 ПЯТНИЦА',
-            'суббота': '📍 СУББОТА',
-            'воскресенье': '📍 ВОСКРЕСЕНЬЕ'
-        }
+        cached = self._day_formatted.get((group, day_lower))
+        if cached is not None:
+            return cached
+        return self._format_day(group, day_lower)
+
+    def get_schedule_for_week(self, group: str) -> str:
+        cached = self._week_formatted.get(group)
+        if cached is not None:
+            return cached
+        return self._format_week(group)
 
+    def _format_day(self, group: str, day: str) -> str:
+        day_lower = day.lower()
         lessons = self.get_schedule_for_day(group, day)
         if not lessons:
-            return f"{day_display.get(day_lower)}\nНет занятий"
+            return f"{DAY_DISPLAY.get(day_lower)}\nНет занятий"
 
-        result = f"{day_display.get(day_lower)}\n"
+        parts = [f"{DAY_DISPLAY.get(day_lower)}\n"]
         for lesson in lessons:
-            result += f"\n{lesson}\n"
-        return result
-
-    def get_schedule_for_week(self, group: str) -> str:
-        days = ['понедельник', 'вторник', 'среда', 'четверг', 'пятница', 'суббота']
-        result = f"📅 Расписание группы {group} на неделю:\n\n"
-        for day in days:
-            result += self.format_day_schedule(group, day)
-            result += "\n" + "─" * 40 + "\n"
-        return result
+            parts.append(f"\n{lesson}\n")
+        return "".join(parts)
+
+    def _format_week(self, group: str) -> str:
+        separator = "\n" + "─" * 40 + "\n"
+        parts = [f"📅 Расписание группы {group} на неделю:\n\n"]
+        for day in WEEK_DAYS:
+            parts.append(self._format_day(group, day))
+            parts.append(separator)
+        return "".join(parts)
 
 
 if __name__ == "__main__":
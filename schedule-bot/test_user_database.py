@@ -1,10 +1,22 @@
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from config import DEFAULT_NOTIFICATION_TIME
+import user_database
 from user_database import UserDatabase
 
 
 def test_user_database():
     """Тестирует функциональность UserDatabase"""
 
-    db = UserDatabase('schedules/test_users.db')
+    db_path = 'schedules/test_users.db'
+    for path in (db_path, db_path + '-wal', db_path + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+
+    db = UserDatabase(db_path)
 
     print("=" * 50)
     print("🧪 ТЕСТИРОВАНИЕ USER DATABASE")
@@ -65,6 +77,7 @@ def test_user_database():
     new_group = db.get_user_group(123456)
     print(f"   Новая группа: {new_group}")
     assert new_group == '09-515 (1)', "Группа не обновлена"
+    assert db.get_user(123456)['group'] == '09-515 (1)', "Кэш get_user не сброшен"
 
     # Тест 9: Отключить уведомления
     print("\n Тест 9: Отключить уведомления")
@@ -89,6 +102,8 @@ def test_user_database():
     print(f"   С уведомлениями: {stats['users_with_notifications']}")
     print(f"   По группам: {stats['groups']}")
     assert stats['total_users'] == 5, "Неверный счет пользователей"
+    assert stats['users_with_notifications'] == 4, "Неверный счет пользователей с уведомлениями"
+    assert stats['groups']['09-512 (2)'] == 2, "Неверная статистика по группам"
 
     # Тест 12: Удалить пользователя
     print("\n Тест 12: Удалить пользователя")
@@ -105,6 +120,64 @@ def test_user_database():
     print(f"   Группа несуществующего пользователя: {group}")
     assert group is None, "Должна вернуться None"
 
+    # Тест 14: Пользователи по времени уведомлений
+    print("\n Тест 14: Получить пользователей по времени уведомлений")
+    result = db.set_notification_time(222222, '09:00')
+    assert result == True, "Ошибка при установке времени"
+    morning_users = db.get_users_by_notification_time('08:00')
+    later_users = db.get_users_by_notification_time('09:00')
+    print(f"   08:00: {morning_users}")
+    print(f"   09:00: {later_users}")
+    assert later_users == {222222: '09-513 (1)'}, "Пользователь не перенесён на 09:00"
+    for bad_time in ('9:00', '24:00', '09:60', '09-00', 'ab:cd'):
+        assert db.set_notification_time(222222, bad_time) == False, f"Принято неверное время {bad_time}"
+    assert set(morning_users) == {123456, 444444}, "Неверный список пользователей на 08:00"
+    db.set_notifications(444444, False)
+    assert 444444 not in db.get_users_by_notification_time('08:00'), "Отключённый пользователь в рассылке"
+    db.set_notifications(444444, True)
+    assert 444444 in db.get_users_by_notification_time('08:00'), "Включённый пользователь не в рассылке"
+
+    # Тест 15: Расписание уведомлений одним запросом
+    print("\n Тест 15: Расписание уведомлений по времени")
+    schedule = db.get_notification_schedule()
+    print(f"   Расписание: {dict(schedule)}")
+    assert schedule['09:00'] == [(222222, '09-513 (1)')], "Неверное расписание на 09:00"
+    assert {user_id for user_id, _ in schedule['08:00']} == {123456, 444444}, "Неверное расписание на 08:00"
+
+    # Тест 16: Повторная регистрация сохраняет настройки
+    print("\n Тест 16: Повторная регистрация пользователя")
+    registered = db.get_user(222222)['registered']
+    result = db.add_user(222222, '09-514 (2)')
+    assert result == True, "Ошибка при повторной регистрации"
+    user = db.get_user(222222)
+    print(f"   Данные: {user}")
+    assert user['group'] == '09-514 (2)', "Группа не обновлена"
+    assert user['notification_time'] == '09:00', "Время уведомлений сброшено"
+    assert user['registered'] == registered, "Дата регистрации перезаписана"
+    assert db.get_users_by_notification_time('09:00') == {222222: '09-514 (2)'}, "Индекс времени сброшен"
+
+    # Тест 17: Параллельная запись через поток-писатель
+    print("\n Тест 17: Параллельная запись из нескольких потоков")
+    new_ids = range(700000, 700200)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda uid: db.add_user(uid, '09-516 (1)'), new_ids))
+    assert all(results), "Не все параллельные записи выполнены"
+    assert len(db.get_users_by_group('09-516 (1)')) == 200, "Параллельные записи потеряны"
+    assert set(new_ids) <= set(db.get_users_by_notification_time('08:00')), "Индекс времени не обновлён"
+    for uid in new_ids:
+        db.delete_user(uid)
+
+    # Тест 18: Пакетное добавление пользователей
+    print("\n Тест 18: Пакетное добавление пользователей")
+    added = db.add_users_bulk([(800001, '09-517 (1)'), (800002, '09-517 (1)'), (222222, '09-517 (1)')])
+    print(f"   Добавлено: {added}")
+    assert added == 3, "Ошибка при пакетном добавлении"
+    assert sorted(db.get_users_by_group('09-517 (1)')) == [222222, 800001, 800002], "Пачка не записана"
+    assert db.get_notification_time(222222) == '09:00', "Пакетная запись сбросила настройки"
+    assert {800001, 800002} <= set(db.get_users_by_notification_time('08:00')), "Индекс времени не обновлён"
+    db.delete_user(800001)
+    db.delete_user(800002)
+
     # Итоги
     print("\n" + "=" * 50)
     print(" ВСЕ ТЕСТЫ ПРОЙДЕНЫ!")
@@ -117,10 +190,231 @@ def test_user_database():
     print(f"   С уведомлениями: {final_stats['users_with_notifications']}")
     print(f"   По группам: {final_stats['groups']}")
 
+    db.close()
+
+
+def test_writer_failures():
+    """Тестирует, что сбой пачки и закрытие БД не подвешивают записи"""
+
+    db_path = 'schedules/test_writer.db'
+    for path in (db_path, db_path + '-wal', db_path + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+    db = UserDatabase(db_path)
+
+    # Исключение вне обработки записей (например, в ROLLBACK) не убивает поток-писатель
+    commit_batch = db._commit_batch
+
+    def failing_commit_batch(batch):
+        db._commit_batch = commit_batch
+        raise sqlite3.OperationalError('disk I/O error')
+
+    db._commit_batch = failing_commit_batch
+    assert db.add_user(111111, '09-512 (1)') == False, "Сбой пачки должен вернуть ошибку"
+    assert db.add_user(111111, '09-512 (1)') == True, "Поток-писатель умер после сбоя"
+    assert db.get_user_group(111111) == '09-512 (1)', "Запись после сбоя не применена"
+
+    # После close() запись сразу завершается ошибкой
+    db.close()
+    assert db.add_user(222222, '09-512 (1)') == False, "Запись после close() должна завершиться ошибкой"
+    os.remove(db_path)
+
+
+def test_legacy_json_migration():
+    """Тестирует импорт пользователей из старой JSON-базы"""
+
+    db_path = 'schedules/test_legacy.db'
+    json_path = 'schedules/test_legacy.json'
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            '555555': {'group': '09-512 (1)', 'registered': '2025-12-08T14:40:31', 'notifications': True},
+            '666666': {'group': '09-514 (1)', 'registered': '2025-12-08T15:26:00', 'notifications': False},
+        }, f)
+
+    db = UserDatabase(db_path, legacy_json_path=json_path)
+    assert db.get_user_group(555555) == '09-512 (1)', "Группа не импортирована"
+    assert db.get_user(666666)['notifications'] == False, "Настройка уведомлений не импортирована"
+    assert len(db.get_all_users()) == 2, "Ожидалось 2 импортированных пользователя"
+
+    # Повторный запуск не должен импортировать пользователей ещё раз
+    db.delete_user(666666)
+    db.close()
+    db = UserDatabase(db_path, legacy_json_path=json_path)
+    assert not db.user_exists(666666), "Миграция должна выполняться только для пустой БД"
+
+    # Даже опустевшая БД не импортирует JSON повторно
+    db.delete_user(555555)
+    db.close()
+    db = UserDatabase(db_path, legacy_json_path=json_path)
+    assert db.get_all_users() == {}, "Удалённые пользователи вернулись из JSON"
+    db.close()
+
+    os.remove(json_path)
+
+
+
+def test_legacy_json_malformed():
+    """Тестирует, что битая JSON-база не мешает запуску"""
+
+    db_path = 'schedules/test_legacy_bad.db'
+    json_path = 'schedules/test_legacy_bad.json'
+
+    for legacy_data in (['555555'], '{not json'):
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        with open(json_path, 'w', encoding='utf-8') as f:
+            f.write(legacy_data if isinstance(legacy_data, str) else json.dumps(legacy_data))
+        db = UserDatabase(db_path, legacy_json_path=json_path)
+        assert db.get_all_users() == {}, f"Из битого файла импортированы пользователи: {legacy_data!r}"
+        assert db.add_user(555555, '09-512 (1)') == True, "БД не работает после битой миграции"
+        db.close()
+
+    # Корректные записи импортируются, битые пропускаются
+    os.remove(db_path)
+    with open(json_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            '555555': {'group': '09-512 (1)'},
+            '666666': {'registered': '2025-12-08T15:26:00'},
+            '777777': '09-514 (1)',
+            'abc': {'group': '09-514 (1)'},
+            '²': {'group': '09-514 (1)'},
+            '٣': {'group': '09-514 (1)'},
+        }, f)
+    db = UserDatabase(db_path, legacy_json_path=json_path)
+    assert list(db.get_all_users()) == [555555], "Битые записи должны пропускаться"
+    assert db.get_user(555555)['registered'] is not None, "Без 'registered' дата регистрации должна быть текущей"
+    db.close()
+
+    os.remove(db_path)
+    os.remove(json_path)
+
+
+def test_default_notification_time():
+    """Тестирует, что время по умолчанию в БД и в индексе берётся из config"""
+
+    db_path = 'schedules/test_default_time.db'
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    # БД, созданная со старым DEFAULT в схеме (10:00)
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY,
+            "group" TEXT NOT NULL,
+            registered TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated TIMESTAMP,
+            notifications BOOLEAN DEFAULT 1,
+            notification_time_min INTEGER DEFAULT 600
+        )
+    ''')
+    conn.commit()
+    conn.close()
+
+    db = UserDatabase(db_path)
+    db.add_user(1, '09-512 (1)')
+    db.add_users_bulk([(2, '09-512 (1)')])
+    assert db.get_notification_time(1) == DEFAULT_NOTIFICATION_TIME, "В БД записано не время из config"
+    assert db.get_notification_time(2) == DEFAULT_NOTIFICATION_TIME, "Пачка записала не время из config"
+    assert set(db.get_users_by_notification_time(DEFAULT_NOTIFICATION_TIME)) == {1, 2}, "Индекс расходится с БД"
+    db.close()
+    os.remove(db_path)
+
+
+def _create_text_time_db(db_path):
+    """Создаёт БД в старой схеме с временем уведомлений строкой HH:MM"""
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY,
+            "group" TEXT NOT NULL,
+            registered TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated TIMESTAMP,
+            notifications BOOLEAN DEFAULT 1,
+            notification_time TEXT DEFAULT '08:00'
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_notif_time ON users(notification_time)')
+    conn.executemany(
+        'INSERT INTO users (user_id, "group", notification_time) VALUES (?, ?, ?)',
+        [(1, '09-512 (1)', '07:30'), (2, '09-512 (1)', '8:00'), (3, '09-512 (1)', None)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def _table_columns(db_path):
+    """Возвращает имена колонок таблицы users"""
+    conn = sqlite3.connect(db_path)
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(users)')}
+    conn.close()
+    return columns
+
+
+def test_notification_time_migration():
+    """Тестирует перенос времени уведомлений из текста HH:MM в минуты"""
+
+    db_path = 'schedules/test_time_migration.db'
+    _create_text_time_db(db_path)
+
+    db = UserDatabase(db_path)
+    assert db.get_notification_time(1) == '07:30', "Время 07:30 не перенесено"
+    assert db.get_notification_time(2) == '08:00', "Время 8:00 не перенесено"
+    assert db.get_notification_time(3) == '08:00', "Пустое время должно стать 08:00"
+    assert set(db.get_users_by_notification_time('08:00')) == {2, 3}, "Неверный индекс времени после миграции"
+    db.close()
+
+    assert 'notification_time' not in _table_columns(db_path), "Старая колонка не удалена"
+    os.remove(db_path)
+
+
+def test_notification_time_migration_without_drop_column():
+    """Тестирует миграцию времени на SQLite без DROP COLUMN (< 3.35)"""
+
+    db_path = 'schedules/test_time_migration_old.db'
+    _create_text_time_db(db_path)
+
+    can_drop = user_database._CAN_DROP_COLUMN
+    user_database._CAN_DROP_COLUMN = False
+    try:
+        db = UserDatabase(db_path)
+        assert db.get_notification_time(1) == '07:30', "Время не перенесено без DROP COLUMN"
+        assert db.set_notification_time(1, '10:00') == True, "Новая колонка недоступна"
+        assert set(db.get_users_by_notification_time('10:00')) == {1}, "Планировщик не видит пользователя"
+        db.close()
+        assert 'notification_time' in _table_columns(db_path), "Старая колонка должна остаться"
+
+        # Повторный запуск не затирает новое время старым значением
+        db = UserDatabase(db_path)
+        assert db.get_notification_time(1) == '10:00', "Время перезаписано повторной миграцией"
+        db.close()
+    finally:
+        user_database._CAN_DROP_COLUMN = can_drop
+
+    # После обновления SQLite старая колонка удаляется, время сохраняется
+    if can_drop:
+        db = UserDatabase(db_path)
+        assert db.get_notification_time(1) == '10:00', "Время потеряно при удалении колонки"
+        db.close()
+        assert 'notification_time' not in _table_columns(db_path), "Старая колонка не удалена"
+    os.remove(db_path)
+
 
 if __name__ == "__main__":
     try:
         test_user_database()
+        test_writer_failures()
+        test_default_notification_time()
+        test_legacy_json_migration()
+        test_legacy_json_malformed()
+        test_notification_time_migration()
+        test_notification_time_migration_without_drop_column()
     except AssertionError as e:
         print(f"\n ТЕСТ НЕ ПРОШЕЛ: {e}")
     except Exception as e:
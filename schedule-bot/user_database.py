@@ -1,330 +1,685 @@
+import json
+import os
+import queue
 import sqlite3
-from typing import Optional, Dict, List
-from datetime import datetime
-from config import USERS_DB
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import Future
+from contextlib import contextmanager
+from urllib.request import pathname2url
+from typing import Any, Callable, Iterable, Optional, Dict, List, Set, Tuple
+from config import USERS_DB, DEFAULT_NOTIFICATION_TIME
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Сколько строк пользователей держать в LRU-кэше get_user
+_USER_CACHE_SIZE = 4096
+# Сколько записей из очереди писателя объединять в одну транзакцию
+_WRITE_BATCH_SIZE = 100
+# Обслуживание WAL в потоке-писателе (автоматический checkpoint отключён), секунды
+_CHECKPOINT_INTERVAL = 60
+_OPTIMIZE_INTERVAL = 15 * 60
+# Если WAL разросся больше этого числа страниц - обрезаем его TRUNCATE-чекпойнтом
+_WAL_TRUNCATE_PAGES = 1000
+
+# Время уведомлений по умолчанию в минутах: единственный источник - config,
+# из него же берутся DEFAULT в схеме и корзина индекса для новых пользователей
+_DEFAULT_NOTIFICATION_MIN = int(DEFAULT_NOTIFICATION_TIME[:2]) * 60 + int(DEFAULT_NOTIFICATION_TIME[3:])
+
+# Все запросы модуля - константы: набор фиксированный, и все они
+# помещаются в кэш подготовленных выражений соединения (cached_statements)
+_SQL_CREATE_TABLE = f'''
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    "group" TEXT NOT NULL,
+    registered TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated TIMESTAMP,
+    notifications BOOLEAN DEFAULT 1,
+    notification_time_min INTEGER DEFAULT {_DEFAULT_NOTIFICATION_MIN}
+)
+'''
+_SQL_TABLE_COLUMNS = 'PRAGMA table_info(users)'
+_SQL_ADD_NOTIF_TIME_MIN_COLUMN = (
+    f'ALTER TABLE users ADD COLUMN notification_time_min INTEGER DEFAULT {_DEFAULT_NOTIFICATION_MIN}'
+)
+_SQL_BACKFILL_NOTIF_TIME_MIN = '''
+UPDATE users
+SET notification_time_min = CAST(substr(notification_time, 1, instr(notification_time, ':') - 1) AS INTEGER) * 60
+                          + CAST(substr(notification_time, instr(notification_time, ':') + 1) AS INTEGER)
+WHERE notification_time LIKE '%:%'
+'''
+_SQL_DROP_NOTIF_TIME_COLUMN = 'ALTER TABLE users DROP COLUMN notification_time'
+# DROP COLUMN появился в SQLite 3.35; на старых версиях текстовая колонка остаётся и не используется
+_CAN_DROP_COLUMN = sqlite3.sqlite_version_info >= (3, 35, 0)
+# Индексы по старой текстовой колонке: удаляем до DROP COLUMN
+_SQL_DROP_OLD_NOTIF_TIME_INDEXES = (
+    'DROP INDEX IF EXISTS idx_notif_time',
+    'DROP INDEX IF EXISTS idx_users_notif_time',
+)
+_SQL_CREATE_NOTIF_TIME_INDEX = '''
+CREATE INDEX IF NOT EXISTS idx_users_notif_time_min
+ON users(notification_time_min, notifications) WHERE notifications = 1
+'''
+_SQL_CREATE_GROUP_INDEX = 'CREATE INDEX IF NOT EXISTS idx_users_group ON users("group")'
+_SQL_HAS_STATS = "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+_SQL_COUNT_USERS = 'SELECT COUNT(*) FROM users'
+# user_version >= 1: импорт старой JSON-базы уже выполнен
+_LEGACY_IMPORT_DONE_VERSION = 1
+_SQL_GET_USER_VERSION = 'PRAGMA user_version'
+_SQL_SET_LEGACY_IMPORT_DONE = f'PRAGMA user_version = {_LEGACY_IMPORT_DONE_VERSION}'
+_SQL_IMPORT_LEGACY_USER = '''
+INSERT OR IGNORE INTO users (user_id, "group", registered, notifications, notification_time_min)
+VALUES (?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ?)
+'''
+# Время хранится минутами от полуночи, наружу отдаётся строкой HH:MM
+_SQL_NOTIFICATION_TIME = "printf('%02d:%02d', notification_time_min / 60, notification_time_min % 60)"
+_SQL_SELECT_GROUPS = 'SELECT user_id, "group" FROM users'
+_SQL_GET_NOTIFICATION_SCHEDULE = f'''
+SELECT {_SQL_NOTIFICATION_TIME}, user_id, "group" FROM users
+WHERE notifications = 1
+ORDER BY notification_time_min
+'''
+# Время передаём явно: DEFAULT в схеме уже созданной БД мог остаться от старого config
+_SQL_ADD_USER = '''
+INSERT INTO users (user_id, "group", notification_time_min) VALUES (?, ?, ?)
+ON CONFLICT(user_id) DO UPDATE SET "group" = excluded."group", updated = CURRENT_TIMESTAMP
+'''
+_SQL_GET_USER = f'''
+SELECT user_id, "group", registered, updated, notifications, {_SQL_NOTIFICATION_TIME} AS notification_time
+FROM users WHERE user_id = ?
+'''
+_SQL_UPDATE_GROUP = '''
+UPDATE users
+SET "group" = ?, updated = CURRENT_TIMESTAMP
+WHERE user_id = ?
+'''
+_SQL_SET_NOTIFICATIONS = '''
+UPDATE users
+SET notifications = ?
+WHERE user_id = ?
+'''
+_SQL_GET_NOTIFICATION_TIME = f'SELECT {_SQL_NOTIFICATION_TIME} FROM users WHERE user_id = ?'
+_SQL_SET_NOTIFICATION_TIME = '''
+UPDATE users
+SET notification_time_min = ?
+WHERE user_id = ?
+'''
+_SQL_GET_ALL_USERS = f'''
+SELECT user_id, "group", registered, updated, notifications, {_SQL_NOTIFICATION_TIME} AS notification_time
+FROM users
+'''
+_SQL_GET_USERS_FOR_NOTIFICATIONS = '''
+SELECT user_id, "group" FROM users
+WHERE notifications = 1
+'''
+_SQL_DELETE_USER = 'DELETE FROM users WHERE user_id = ?'
+_SQL_GET_USERS_BY_GROUP = 'SELECT user_id FROM users WHERE "group" = ?'
+_SQL_GROUP_STATS = '''
+SELECT "group", COUNT(*) as count, SUM(CASE WHEN notifications = 1 THEN 1 ELSE 0 END)
+FROM users
+GROUP BY "group"
+ORDER BY count DESC
+'''
+
 
 class UserDatabase:
     """Класс для управления БД пользователей на SQLite"""
 
-    def __init__(self, db_path: str = USERS_DB):
+    def __init__(self, db_path: str = USERS_DB, legacy_json_path: Optional[str] = None):
         self.db_path = db_path
+        self.legacy_json_path = legacy_json_path
+        # Долгоживущие соединения: страничный кэш SQLite не теряется между вызовами.
+        # Одно соединение на запись и по read-only соединению на поток: в WAL
+        # чтения идут параллельно с записью и не ждут её блокировку
+        self._write_lock = threading.RLock()
+        self._write_conn: Optional[sqlite3.Connection] = self._connect()
+        self._local = threading.local()
+        self._read_conns: List[sqlite3.Connection] = []
+        # Защищает кэши в памяти и список read-only соединений
+        self._lock = threading.RLock()
         self._ensure_db_exists()
+        # Кэш {user_id: group}: группа нужна на каждый апдейт, в БД за ней не ходим
+        self._group_cache: Dict[int, str] = self._load_group_cache()
+        # Индекс {время: user_id} для пользователей с включёнными уведомлениями
+        self._time_index: Dict[str, Set[int]] = self._load_time_index()
+        # LRU-кэш полных строк для get_user, сбрасывается при любой записи пользователя
+        self._user_cache: Dict[int, Dict] = OrderedDict()
+        # Счётчик закоммиченных пачек: строку, прочитанную до коммита, не кэшируем
+        self._write_seq = 0
+        # Все записи идут через один поток-писатель: он пачками коммитит очередь
+        # и применяет обновления кэшей строго в порядке коммитов
+        self._write_queue: queue.Queue = queue.Queue()
+        # Проверка «БД закрыта» и постановка в очередь атомарны относительно close()
+        self._queue_lock = threading.Lock()
+        self._writer = threading.Thread(target=self._writer_loop, name='user-db-writer', daemon=True)
+        self._writer.start()
+
+    def _connect(self, read_only: bool = False) -> sqlite3.Connection:
+        """Открывает соединение с БД и применяет настройки производительности"""
+        # isolation_level=None: транзакции открываем сами (BEGIN IMMEDIATE в _transaction)
+        if read_only:
+            # mode=ro в WAL работает, пока открыто соединение на запись (есть -shm)
+            database = 'file:' + pathname2url(os.path.abspath(self.db_path)) + '?mode=ro'
+        else:
+            database = self.db_path
+        conn = sqlite3.connect(
+            database, uri=read_only, check_same_thread=False, isolation_level=None, cached_statements=256
+        )
+        # WAL + synchronous=NORMAL: один последовательный write вместо fsync на каждый коммит
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-64000')  # ~64 МБ страничного кэша
+        conn.execute('PRAGMA busy_timeout=30000')
+        if not read_only:
+            # Checkpoint не выполняется внутри COMMIT - его делает писатель по таймеру
+            conn.execute('PRAGMA wal_autocheckpoint=0')
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        """Возвращает read-only соединение текущего потока"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect(read_only=True)
+            self._local.conn = conn
+            with self._lock:
+                self._read_conns.append(conn)
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Выполняет запись в одной транзакции на соединении для записи"""
+        with self._write_lock:
+            cursor = self._write_conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                yield cursor
+                cursor.execute('COMMIT')
+            except BaseException:
+                if self._write_conn.in_transaction:
+                    cursor.execute('ROLLBACK')
+                raise
+
+    def _write(self, work: Callable[[sqlite3.Cursor], Any],
+               on_commit: Optional[Callable[[Any], None]] = None) -> Any:
+        """Ставит запись в очередь писателя и ждёт её коммита"""
+        future = Future()
+        with self._queue_lock:
+            if self._writer is None:
+                raise sqlite3.ProgrammingError('Cannot operate on a closed database.')
+            self._write_queue.put((work, on_commit, future))
+        return future.result()
+
+    def _execute_write(self, sql: str, params: tuple,
+                       on_commit: Optional[Callable[[int], None]] = None) -> int:
+        """Выполняет одно изменяющее выражение через писателя, возвращает rowcount"""
+        return self._write(lambda cursor: cursor.execute(sql, params).rowcount, on_commit)
+
+    def _writer_loop(self):
+        """Поток-писатель: забирает записи из очереди и коммитит их пачками"""
+        next_checkpoint = time.monotonic() + _CHECKPOINT_INTERVAL
+        next_optimize = time.monotonic() + _OPTIMIZE_INTERVAL
+        stop = False
+        while not stop:
+            batch = []
+            try:
+                # Ждём записи не дольше, чем до следующего checkpoint
+                batch.append(self._write_queue.get(timeout=max(0.0, next_checkpoint - time.monotonic())))
+            except queue.Empty:
+                pass
+            while batch and len(batch) < _WRITE_BATCH_SIZE:
+                try:
+                    batch.append(self._write_queue.get_nowait())
+                except queue.Empty:
+                    break
+            # None в очереди - сигнал остановки от close()
+            stop = None in batch
+            if stop:
+                batch = [item for item in batch if item is not None]
+            if batch:
+                try:
+                    self._commit_batch(batch)
+                except Exception as e:
+                    # Писатель не должен умирать: иначе все следующие записи зависнут
+                    logger.error("❌ Ошибка потока записи: %s", e)
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+
+            # Обслуживание по прошедшему времени, а не только в простое
+            now = time.monotonic()
+            if now >= next_checkpoint:
+                self._checkpoint()
+                next_checkpoint = now + _CHECKPOINT_INTERVAL
+            if now >= next_optimize:
+                self._optimize()
+                next_optimize = now + _OPTIMIZE_INTERVAL
+
+    def _checkpoint(self):
+        """Переносит WAL в основной файл БД, при разросшемся WAL обрезает его"""
+        try:
+            with self._write_lock:
+                _, wal_pages, _ = self._write_conn.execute('PRAGMA wal_checkpoint(PASSIVE)').fetchone()
+                if wal_pages > _WAL_TRUNCATE_PAGES:
+                    self._write_conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка checkpoint WAL: %s", e)
+
+    def _optimize(self):
+        """Обновляет статистику планировщика запросов"""
+        try:
+            with self._write_lock:
+                self._write_conn.execute('PRAGMA optimize')
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка PRAGMA optimize: %s", e)
+
+    def _commit_batch(self, batch: list):
+        """Выполняет пачку записей в одной транзакции, каждую в своей точке сохранения"""
+        results = []
+        with self._write_lock:
+            cursor = self._write_conn.cursor()
+            try:
+                cursor.execute('BEGIN IMMEDIATE')
+                for work, _, _ in batch:
+                    # Ошибка одной записи откатывает только её, а не всю пачку
+                    cursor.execute('SAVEPOINT write')
+                    try:
+                        results.append((work(cursor), None))
+                        cursor.execute('RELEASE write')
+                    except Exception as e:
+                        cursor.execute('ROLLBACK TO write')
+                        cursor.execute('RELEASE write')
+                        results.append((None, e))
+                cursor.execute('COMMIT')
+            except Exception as e:
+                try:
+                    if self._write_conn.in_transaction:
+                        cursor.execute('ROLLBACK')
+                finally:
+                    for _, _, future in batch:
+                        future.set_exception(e)
+                return
+
+        # Кэши обновляем только после успешного COMMIT и в порядке записей
+        with self._lock:
+            self._write_seq += 1
+            for (_, on_commit, future), (result, error) in zip(batch, results):
+                if error is None and on_commit is not None:
+                    try:
+                        on_commit(result)
+                    except Exception as e:
+                        error = e
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(error)
+
+    def close(self):
+        """Закрывает соединение с БД"""
+        # Дожидаемся, пока писатель закоммитит всё, что уже в очереди
+        with self._queue_lock:
+            writer, self._writer = self._writer, None
+            if writer is not None:
+                self._write_queue.put(None)
+        if writer is not None:
+            writer.join()
+        # Записи, не попавшие в последнюю пачку, завершаем ошибкой, а не оставляем ждать
+        while True:
+            try:
+                item = self._write_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                item[2].set_exception(sqlite3.ProgrammingError('Cannot operate on a closed database.'))
+        with self._lock:
+            read_conns, self._read_conns = self._read_conns, []
+        for conn in read_conns:
+            conn.close()
+        with self._write_lock:
+            if self._write_conn is None:
+                return
+            try:
+                self._write_conn.execute('PRAGMA optimize')
+            finally:
+                self._write_conn.close()
+                self._write_conn = None
 
     def _ensure_db_exists(self):
         """Создает таблицы БД если их нет или обновляет схему"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            # Таблица пользователей (используем двойные кавычки для "group")
-            cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                "group" TEXT NOT NULL,
-                registered TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated TIMESTAMP,
-                notifications BOOLEAN DEFAULT 1,
-                notification_time TEXT DEFAULT '08:00'
+            # WAL сохраняется в файле БД: читатели не блокируются писателем
+            self._write_conn.execute('PRAGMA journal_mode=WAL')
+
+            with self._transaction() as cursor:
+                # Таблица пользователей (используем двойные кавычки для "group")
+                cursor.execute(_SQL_CREATE_TABLE)
+
+                # Миграция: время уведомлений из текста HH:MM в минуты от полуночи
+                for sql in _SQL_DROP_OLD_NOTIF_TIME_INDEXES:
+                    cursor.execute(sql)
+                columns = {row[1] for row in cursor.execute(_SQL_TABLE_COLUMNS)}
+                if 'notification_time_min' not in columns:
+                    logger.info("📦 Миграция: добавляем колонку notification_time_min")
+                    cursor.execute(_SQL_ADD_NOTIF_TIME_MIN_COLUMN)
+                    # Переносим значения только при создании колонки, иначе затрём новые настройки
+                    if 'notification_time' in columns:
+                        logger.info("📦 Миграция: переносим notification_time в минуты")
+                        cursor.execute(_SQL_BACKFILL_NOTIF_TIME_MIN)
+                if 'notification_time' in columns and _CAN_DROP_COLUMN:
+                    cursor.execute(_SQL_DROP_NOTIF_TIME_COLUMN)
+
+                # Частичный индекс для планировщика: только пользователи с уведомлениями
+                cursor.execute(_SQL_CREATE_NOTIF_TIME_INDEX)
+                # Индекс для get_users_by_group и статистики по группам
+                cursor.execute(_SQL_CREATE_GROUP_INDEX)
+
+                # Импорт JSON - однократный: отметка в user_version коммитится вместе с данными,
+                # поэтому удалённые позже пользователи не вернутся при следующем запуске
+                cursor.execute(_SQL_GET_USER_VERSION)
+                if cursor.fetchone()[0] < _LEGACY_IMPORT_DONE_VERSION and self.legacy_json_path:
+                    cursor.execute(_SQL_COUNT_USERS)
+                    if cursor.fetchone()[0] > 0 or self._migrate_from_json(cursor):
+                        cursor.execute(_SQL_SET_LEGACY_IMPORT_DONE)
+
+                # Статистика для планировщика запросов - один раз, дальше её обновляет PRAGMA optimize
+                cursor.execute(_SQL_HAS_STATS)
+                if cursor.fetchone() is None:
+                    cursor.execute('ANALYZE')
+
+            logger.info("✅ БД инициализирована: %s", self.db_path)
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка при инициализации БД: %s", e)
+
+    def _migrate_from_json(self, cursor: sqlite3.Cursor) -> bool:
+        """Переносит пользователей из старой JSON-базы в пустую таблицу, возвращает True если файл прочитан"""
+        if not os.path.exists(self.legacy_json_path):
+            return False
+
+        try:
+            with open(self.legacy_json_path, 'r', encoding='utf-8') as f:
+                legacy_users = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error("❌ Миграция: не удалось прочитать %s: %s", self.legacy_json_path, e)
+            return False
+
+        if not isinstance(legacy_users, dict):
+            logger.warning("⚠️ Миграция: %s не содержит словарь пользователей, пропускаем", self.legacy_json_path)
+            return False
+
+        # Битые записи пропускаем: из-за старого файла бот не должен падать на старте
+        rows = []
+        for user_id, data in legacy_users.items():
+            if not (isinstance(data, dict) and isinstance(data.get('group'), str) and user_id.isascii() and user_id.isdecimal()):
+                logger.warning("⚠️ Миграция: пропускаем некорректную запись %r", user_id)
+                continue
+            rows.append(
+                (int(user_id), data['group'], data.get('registered'),
+                 1 if data.get('notifications', True) else 0, _DEFAULT_NOTIFICATION_MIN)
             )
-            ''')
+        cursor.executemany(_SQL_IMPORT_LEGACY_USER, rows)
+        logger.info("📦 Миграция: импортировано %s пользователей из %s", len(rows), self.legacy_json_path)
+        return True
 
-            # Миграция: добавляем колонку notification_time если её нет
-            try:
-                cursor.execute('SELECT notification_time FROM users LIMIT 1')
-            except sqlite3.OperationalError:
-                # Колонка не существует, добавляем её
-                logger.info("📦 Миграция: добавляем колонку notification_time")
-                cursor.execute('ALTER TABLE users ADD COLUMN notification_time TEXT DEFAULT "08:00"')
+    def _load_group_cache(self) -> Dict[int, str]:
+        """Загружает группы всех пользователей в память"""
+        try:
+            # Строки идут из курсора прямо в dict, без промежуточного списка
+            return dict(self._reader().execute(_SQL_SELECT_GROUPS))
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка при загрузке кэша групп: %s", e)
+            return {}
 
-            conn.commit()
-            conn.close()
-            logger.info(f"✅ БД инициализирована: {self.db_path}")
-        except Exception as e:
-            logger.error(f"❌ Ошибка при инициализации БД: {str(e)}")
+    def _load_time_index(self) -> Dict[str, Set[int]]:
+        """Загружает индекс времени уведомлений в память"""
+        index = defaultdict(set)
+        for time_str, users in self.get_notification_schedule().items():
+            index[time_str] = {user_id for user_id, _ in users}
+        return index
+
+    def _unindex_time(self, user_id: int) -> bool:
+        """Убирает пользователя из индекса времени, возвращает True если он там был"""
+        for users in self._time_index.values():
+            if user_id in users:
+                users.discard(user_id)
+                return True
+        return False
 
     def add_user(self, user_id: int, group: str) -> bool:
         """Добавляет или обновляет пользователя"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute('''
-            INSERT OR REPLACE INTO users (user_id, "group", registered, notifications, notification_time)
-            VALUES (?, ?, CURRENT_TIMESTAMP, 1, '08:00')
-            ''', (user_id, group))
+        def apply(_):
+            # Повторная регистрация меняет только группу: дата регистрации
+            # и настройки уведомлений сохраняются
+            is_new = user_id not in self._group_cache
+            self._group_cache[user_id] = group
+            self._user_cache.pop(user_id, None)
+            if is_new:
+                self._time_index[DEFAULT_NOTIFICATION_TIME].add(user_id)
 
-            conn.commit()
-            conn.close()
-            logger.info(f"✅ Пользователь {user_id} зарегистрирован с группой {group}")
+        try:
+            self._execute_write(_SQL_ADD_USER, (user_id, group, _DEFAULT_NOTIFICATION_MIN), apply)
+            logger.info("✅ Пользователь %s зарегистрирован с группой %s", user_id, group)
             return True
-        except Exception as e:
-            logger.error(f"❌ Ошибка при добавлении пользователя: {str(e)}")
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка при добавлении пользователя: %s", e)
             return False
 
-    def get_user_group(self, user_id: int) -> Optional[str]:
-        """Возвращает группу пользователя"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+    def add_users_bulk(self, rows: Iterable[Tuple[int, str]]) -> int:
+        """Добавляет или обновляет пользователей пачкой (user_id, group) в одной транзакции"""
+        rows = list(rows)
 
-            cursor.execute('SELECT "group" FROM users WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            conn.close()
+        def apply(_):
+            for user_id, group in rows:
+                is_new = user_id not in self._group_cache
+                self._group_cache[user_id] = group
+                self._user_cache.pop(user_id, None)
+                if is_new:
+                    self._time_index[DEFAULT_NOTIFICATION_TIME].add(user_id)
 
-            return result[0] if result else None
-        except Exception as e:
-            logger.error(f"❌ Ошибка при получении группы: {str(e)}")
-            return None
+        try:
+            params = [(user_id, group, _DEFAULT_NOTIFICATION_MIN) for user_id, group in rows]
+            self._write(lambda cursor: cursor.executemany(_SQL_ADD_USER, params), apply)
+            logger.info("✅ Зарегистрировано пользователей пачкой: %s", len(rows))
+            return len(rows)
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка при пакетном добавлении пользователей: %s", e)
+            return 0
+
+    def get_user_group(self, user_id: int) -> Optional[str]:
+        """Возвращает группу пользователя"""
+        return self._group_cache.get(user_id)
 
     def get_user(self, user_id: int) -> Optional[Dict]:
         """Возвращает полные данные пользователя"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute('''
-            SELECT user_id, "group", registered, updated, notifications, notification_time
-            FROM users WHERE user_id = ?
-            ''', (user_id,))
-
-            result = cursor.fetchone()
-            conn.close()
-
-            if result:
-                return {
-                    'user_id': result[0],
-                    'group': result[1],
-                    'registered': result[2],
-                    'updated': result[3],
-                    'notifications': bool(result[4]),
-                    'notification_time': result[5] if result[5] else '08:00'
-                }
-            return None
-        except Exception as e:
-            logger.error(f"❌ Ошибка при получении данных: {str(e)}")
+            with self._lock:
+                user = self._user_cache.get(user_id)
+                if user is not None:
+                    self._user_cache.move_to_end(user_id)
+                    return dict(user)
+                write_seq = self._write_seq
+
+            cursor = self._reader().cursor()
+            cursor.row_factory = sqlite3.Row
+            row = cursor.execute(_SQL_GET_USER, (user_id,)).fetchone()
+            if not row:
+                return None
+
+            # Ключи - имена колонок запроса; notifications - 0/1 как хранится в БД
+            user = dict(row)
+            with self._lock:
+                # Пока читали, писатель мог закоммитить изменения - такую строку не кэшируем
+                if self._write_seq == write_seq:
+                    self._user_cache[user_id] = user
+                    if len(self._user_cache) > _USER_CACHE_SIZE:
+                        self._user_cache.popitem(last=False)
+            # Копия, чтобы вызывающий код не испортил закэшированную строку
+            return dict(user)
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка при получении данных: %s", e)
             return None
 
     def user_exists(self, user_id: int) -> bool:
         """Проверяет, зарегистрирован ли пользователь"""
-        return self.get_user_group(user_id) is not None
+        # Кэш групп содержит всех пользователей - достаточно проверки ключа
+        return user_id in self._group_cache
 
     def update_group(self, user_id: int, new_group: str) -> bool:
         """Обновляет группу пользователя"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute('''
-            UPDATE users
-            SET "group" = ?, updated = CURRENT_TIMESTAMP
-            WHERE user_id = ?
-            ''', (new_group, user_id))
-
-            affected = cursor.rowcount
-            conn.commit()
-            conn.close()
+        def apply(affected):
+            if affected > 0:
+                self._group_cache[user_id] = new_group
+                self._user_cache.pop(user_id, None)
 
+        try:
+            affected = self._execute_write(_SQL_UPDATE_GROUP, (new_group, user_id), apply)
             if affected > 0:
-                logger.info(f"✅ Группа {user_id} → {new_group}")
+                logger.info("✅ Группа %s → %s", user_id, new_group)
                 return True
             return False
-        except Exception as e:
-            logger.error(f"❌ Ошибка при обновлении группы: {str(e)}")
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка при обновлении группы: %s", e)
             return False
 
     def set_notifications(self, user_id: int, enabled: bool) -> bool:
         """Включает/выключает уведомления"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute('''
-            UPDATE users
-            SET notifications = ?
-            WHERE user_id = ?
-            ''', (1 if enabled else 0, user_id))
-
+        def work(cursor):
+            cursor.execute(_SQL_SET_NOTIFICATIONS, (1 if enabled else 0, user_id))
             affected = cursor.rowcount
-            conn.commit()
-            conn.close()
+            time_str = None
+            if affected > 0 and enabled:
+                cursor.execute(_SQL_GET_NOTIFICATION_TIME, (user_id,))
+                time_str = cursor.fetchone()[0]
+            return affected, time_str
+
+        def apply(result):
+            affected, time_str = result
+            if affected > 0:
+                self._user_cache.pop(user_id, None)
+                self._unindex_time(user_id)
+                if enabled:
+                    self._time_index[time_str].add(user_id)
 
+        try:
+            affected, _ = self._write(work, apply)
             if affected > 0:
-                logger.info(f"✅ Уведомления {user_id}: {enabled}")
+                logger.info("✅ Уведомления %s: %s", user_id, enabled)
                 return True
             return False
-        except Exception as e:
-            logger.error(f"❌ Ошибка при изменении уведомлений: {str(e)}")
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка при изменении уведомлений: %s", e)
             return False
 
     def set_notification_time(self, user_id: int, time_str: str) -> bool:
         """Устанавливает время отправки расписания (формат: HH:MM)"""
         try:
-            # Валидация формата
-            parts = time_str.split(':')
-            if len(parts) != 2:
+            # Валидация формата без исключений: строго HH:MM из ASCII-цифр,
+            # как его формирует планировщик через strftime('%H:%M')
+            if (len(time_str) != 5 or time_str[2] != ':' or not time_str.isascii()
+                    or not time_str[:2].isdigit() or not time_str[3:].isdigit()):
                 return False
-            hours, minutes = int(parts[0]), int(parts[1])
+            hours, minutes = int(time_str[:2]), int(time_str[3:])
             if not (0 <= hours <= 23 and 0 <= minutes <= 59):
                 return False
 
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-            UPDATE users
-            SET notification_time = ?
-            WHERE user_id = ?
-            ''', (time_str, user_id))
-            affected = cursor.rowcount
-            conn.commit()
-            conn.close()
+            def apply(affected):
+                if affected > 0:
+                    self._user_cache.pop(user_id, None)
+                    # Переносим в новую корзину, только если уведомления включены
+                    if self._unindex_time(user_id):
+                        self._time_index[time_str].add(user_id)
 
+            affected = self._execute_write(_SQL_SET_NOTIFICATION_TIME, (hours * 60 + minutes, user_id), apply)
             if affected > 0:
-                logger.info(f"✅ Время уведомлений {user_id}: {time_str}")
+                logger.info("✅ Время уведомлений %s: %s", user_id, time_str)
                 return True
             return False
-        except Exception as e:
-            logger.error(f"❌ Ошибка при установке времени: {str(e)}")
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка при установке времени: %s", e)
             return False
 
     def get_notification_time(self, user_id: int) -> Optional[str]:
         """Возвращает установленное время отправки"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('SELECT notification_time FROM users WHERE user_id = ?', (user_id,))
-            result = cursor.fetchone()
-            conn.close()
-            return result[0] if result and result[0] else '08:00'
-        except Exception as e:
-            logger.error(f"❌ Ошибка получения времени: {str(e)}")
-            return '08:00'
+        user = self.get_user(user_id)
+        return user['notification_time'] if user else DEFAULT_NOTIFICATION_TIME
 
     def get_users_by_notification_time(self, time_str: str) -> Dict[int, str]:
         """Возвращает {user_id: group} пользователей, у которых сейчас время уведомлений"""
-        try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            cursor.execute('''
-            SELECT user_id, "group" FROM users
-            WHERE notifications = 1 AND notification_time = ?
-            ''', (time_str,))
-            users = {row[0]: row[1] for row in cursor.fetchall()}
-            conn.close()
-            return users
-        except Exception as e:
-            logger.error(f"❌ Ошибка при получении пользователей: {str(e)}")
-            return {}
+        with self._lock:
+            return {
+                user_id: self._group_cache[user_id]
+                for user_id in self._time_index.get(time_str, ())
+            }
 
     def get_all_users(self) -> Dict[int, Dict]:
         """Возвращает всех пользователей"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute('''
-            SELECT user_id, "group", registered, updated, notifications, notification_time
-            FROM users
-            ''')
-
-            users = {}
-            for row in cursor.fetchall():
-                users[row[0]] = {
-                    'group': row[1],
-                    'registered': row[2],
-                    'updated': row[3],
-                    'notifications': bool(row[4]),
-                    'notification_time': row[5] if row[5] else '08:00'
-                }
-
-            conn.close()
-            return users
-        except Exception as e:
-            logger.error(f"❌ Ошибка при получении пользователей: {str(e)}")
+            cursor = self._reader().cursor()
+            cursor.row_factory = sqlite3.Row
+            return {row['user_id']: dict(row) for row in cursor.execute(_SQL_GET_ALL_USERS)}
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка при получении пользователей: %s", e)
             return {}
 
     def get_users_for_notifications(self) -> Dict[int, str]:
         """Возвращает {user_id: group} с уведомлениями"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute('''
-            SELECT user_id, "group" FROM users
-            WHERE notifications = 1
-            ''')
-
-            users = {row[0]: row[1] for row in cursor.fetchall()}
-            conn.close()
-            return users
-        except Exception as e:
-            logger.error(f"❌ Ошибка при получении пользователей: {str(e)}")
+            return dict(self._reader().execute(_SQL_GET_USERS_FOR_NOTIFICATIONS))
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка при получении пользователей: %s", e)
             return {}
 
-    def delete_user(self, user_id: int) -> bool:
-        """Удаляет пользователя"""
+    def get_notification_schedule(self) -> Dict[str, List[Tuple[int, str]]]:
+        """Возвращает {время: [(user_id, group)]} всех пользователей с уведомлениями одним запросом"""
+        schedule = defaultdict(list)
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            for time_str, user_id, group in self._reader().execute(_SQL_GET_NOTIFICATION_SCHEDULE):
+                schedule[time_str].append((user_id, group))
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка при получении расписания уведомлений: %s", e)
+        return schedule
 
-            cursor.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
-            affected = cursor.rowcount
-            conn.commit()
-            conn.close()
+    def delete_user(self, user_id: int) -> bool:
+        """Удаляет пользователя"""
+        def apply(_):
+            self._group_cache.pop(user_id, None)
+            self._user_cache.pop(user_id, None)
+            self._unindex_time(user_id)
 
+        try:
+            affected = self._execute_write(_SQL_DELETE_USER, (user_id,), apply)
             if affected > 0:
-                logger.info(f"✅ Пользователь {user_id} удален")
+                logger.info("✅ Пользователь %s удален", user_id)
                 return True
             return False
-        except Exception as e:
-            logger.error(f"❌ Ошибка при удалении: {str(e)}")
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка при удалении: %s", e)
             return False
 
     def get_users_by_group(self, group: str) -> List[int]:
         """Возвращает user_id для группы"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute('SELECT user_id FROM users WHERE "group" = ?', (group,))
-            users = [row[0] for row in cursor.fetchall()]
-            conn.close()
-
-            return users
-        except Exception as e:
-            logger.error(f"❌ Ошибка при получении пользователей: {str(e)}")
+            return [row[0] for row in self._reader().execute(_SQL_GET_USERS_BY_GROUP, (group,))]
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка при получении пользователей: %s", e)
             return []
 
     def get_stats(self) -> Dict:
         """Возвращает статистику БД"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-
-            cursor.execute('SELECT COUNT(*) FROM users')
-            total = cursor.fetchone()[0]
-
-            cursor.execute('SELECT COUNT(*) FROM users WHERE notifications = 1')
-            notif = cursor.fetchone()[0]
-
-            cursor.execute('''
-            SELECT "group", COUNT(*) as count
-            FROM users
-            GROUP BY "group"
-            ORDER BY count DESC
-            ''')
-
-            groups = {row[0]: row[1] for row in cursor.fetchall()}
-            conn.close()
+            # Один проход по таблице: итоги считаем из разбивки по группам
+            total = notif = 0
+            groups = {}
+            for group, count, notified in self._reader().execute(_SQL_GROUP_STATS):
+                groups[group] = count
+                total += count
+                notif += notified
 
             return {
                 'total_users': total,
                 'users_with_notifications': notif,
                 'groups': groups
             }
-        except Exception as e:
-            logger.error(f"❌ Ошибка статистики: {str(e)}")
-            return {}
\ No newline at end of file
+        except sqlite3.Error as e:
+            logger.error("❌ Ошибка статистики: %s", e)
+            return {}